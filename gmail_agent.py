@@ -1,4 +1,6 @@
-from typing import Optional, List, Callable, Dict
+from typing import Optional, List, Callable
+from dataclasses import dataclass
+from functools import lru_cache
 import os
 from dotenv import load_dotenv
 from agno.agent import Agent
@@ -8,12 +10,109 @@ from rich import print
 import typer
 from typing_extensions import Annotated
 from enum import Enum
-import re
 import json
+import logging
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from pybase64 import urlsafe_b64decode
+except ImportError:
+    from base64 import urlsafe_b64decode
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Below this many requested emails the response is small enough that a
+# plain full-buffer parse is cheaper than streaming
+_STREAM_MIN_COUNT = 10
+
+# Prompt templates built once at import; call sites substitute with %
+_UNREAD_PROMPT = "Show me my latest %d unread emails. Output a JSON object with a single key \"emails\" whose value is an array of objects, one per email, with the following fields: id, thread_id, from, subject, date, body. Output the JSON object and nothing else."
+
+_EMAIL_FIELDS = """1. Message ID (prefix with 'ID: ')
+2. From
+3. Subject
+4. Date
+5. Body"""
+
+_READ_PROMPT = """Show me my latest %d unread emails. For each email, display:
+""" + _EMAIL_FIELDS + """
+
+Format each email clearly with separators and make the Message ID prominent."""
+
+_SEARCH_PROMPT = """Search my emails for '%s' and show me the top %d results. For each email, display:
+""" + _EMAIL_FIELDS + """
+
+Format each email clearly with separators and make the Message ID prominent."""
+
+_NEEDS_REPLY_PROMPT = """Find %d important emails that need replies. For each email, display:
+""" + _EMAIL_FIELDS + """
+6. Suggested Reply
+
+Format each email clearly with separators and make the Message ID prominent."""
+
+_SUGGEST_REPLY_PROMPT = """Get the email with message ID %s. Show:
+""" + _EMAIL_FIELDS + """
+6. Suggested Reply
+
+Format the email clearly and make the Message ID prominent."""
+
+class _ChunkReader:
+    """Minimal file-like adapter feeding streamed LLM chunks to ijson."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, size=-1):
+        for chunk in self._chunks:
+            content = getattr(chunk, "content", chunk) or ""
+            if not isinstance(content, (str, bytes)):
+                continue
+            if isinstance(content, str):
+                content = content.encode()
+            if content:
+                return content
+        return b""
+if msgspec is not None:
+    class Email(msgspec.Struct):
+        """One parsed email; msgspec decodes the LLM JSON directly into these."""
+        message_id: str = msgspec.field(name="id", default="")
+        thread_id: str = ""
+        sender: str = msgspec.field(name="from", default="")
+        subject: str = ""
+        date: str = ""
+        body: str = ""
+
+    class _EmailEnvelope(msgspec.Struct):
+        """JSON-mode responses wrap the array in an object: {"emails": [...]}."""
+        emails: List[Email] = []
+else:
+    @dataclass(slots=True)
+    class Email:
+        """One parsed email; slotted fields are lighter than a per-email dict."""
+        message_id: str = ""
+        thread_id: str = ""
+        sender: str = ""
+        subject: str = ""
+        date: str = ""
+        body: str = ""
+
 class EmailAction(str, Enum):
     READ = "read"
     REPLY = "reply"
@@ -22,55 +121,212 @@ class EmailAction(str, Enum):
     ALL = "all"
     REPLY_TO = "reply-to"
 
+@lru_cache(maxsize=1)
+def _shared_gmail_tools() -> GmailTools:
+    """Single GmailTools instance so OAuth setup and API discovery run once per process."""
+    return GmailTools()
+
 class GmailAgent:
-    def __init__(self, notify_callback: Optional[Callable[[List[Dict]], None]] = None):
+    def __init__(self, notify_callback: Optional[Callable[[List[Email]], None]] = None, service=None):
+        gmail_tools = _shared_gmail_tools()
         self.agent = Agent(
-            model=OpenAIChat(id="gpt-3.5-turbo"),
-            tools=[GmailTools()],
+            model=OpenAIChat(id="gpt-4o-mini"),
+            tools=[gmail_tools],
             show_tool_calls=True,
             markdown=True
         )
-        self.gmail_tools = GmailTools()
+        # Separate agent in JSON mode for the structured unread-email listing;
+        # the model then emits a bare JSON object with no markdown fences
+        self.json_agent = Agent(
+            model=OpenAIChat(id="gpt-4o-mini", response_format={"type": "json_object"}),
+            tools=[gmail_tools],
+            show_tool_calls=True,
+            markdown=False
+        )
+        self.gmail_tools = gmail_tools
         self.notify_callback = notify_callback
+        self._last_history_id = None
+        self._service = service
 
     def check_new_emails(self, count: int = 5):
         """
-        Checks for new emails using a JSON-based LLM prompt and notifies via callback if set.
-        Returns a list of email details (dicts).
+        Checks for new emails and notifies via callback if set.
+        Polls the Gmail history API keyed on the last seen historyId, so idle
+        cycles cost one cheap HTTP call instead of an LLM round-trip. Falls
+        back to the JSON-based LLM prompt when history isn't available yet.
+        Returns a list of Email records.
+        """
+        emails = None
+        try:
+            emails = self._check_via_history(count)
+        except Exception as e:
+            print(f"[GmailAgent] History poll failed, falling back to LLM: {e}")
+            # An expired/invalid startHistoryId fails with 404 until a full
+            # resync; clear it so the next cycle reseeds from getProfile
+            self._last_history_id = None
+        if emails is None:
+            emails = self._check_via_llm(count)
+        logger.debug("Calling notify_callback with emails: %s", emails)
+        if self.notify_callback:
+            self.notify_callback(emails)
+        return emails
+
+    def _get_service(self):
+        if self._service is None:
+            # GmailTools builds its Gmail API client lazily; trigger auth if needed
+            if getattr(self.gmail_tools, "service", None) is None:
+                authenticate = getattr(self.gmail_tools, "_authenticate", None)
+                if authenticate:
+                    authenticate()
+            self._service = getattr(self.gmail_tools, "service", None)
+        return self._service
+
+    def _check_via_history(self, count: int):
+        """
+        Returns new emails discovered via users.history.list, [] when the
+        inbox is idle, or None when the LLM fallback should run instead.
         """
-        prompt = (
-            f"Show me my latest {count} unread emails. For each email, output a JSON object with the following fields: id, thread_id, from, subject, date, body. Output a JSON array of these objects and nothing else."
+        service = self._get_service()
+        if service is None:
+            return None
+        if self._last_history_id is None:
+            # First poll: record the current historyId and let the LLM path
+            # list whatever is already unread.
+            profile = service.users().getProfile(userId="me").execute()
+            self._last_history_id = profile.get("historyId")
+            return None
+        history = service.users().history().list(
+            userId="me",
+            startHistoryId=self._last_history_id,
+            historyTypes=["messageAdded"],
+            labelId="UNREAD",
+        ).execute()
+        self._last_history_id = history.get("historyId", self._last_history_id)
+        message_ids = []
+        for record in history.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = added.get("message", {}).get("id")
+                if msg_id:
+                    message_ids.append(msg_id)
+        if not message_ids:
+            return []
+        # Fetch all metadata in one batched HTTP round-trip instead of N serial calls
+        emails = []
+
+        def _collect(request_id, msg, exception):
+            if exception is not None:
+                print(f"[GmailAgent] Metadata fetch failed: {exception}")
+            elif msg:
+                # Keep the baseline "unread emails" semantics: skip anything
+                # no longer unread, the user's own sent mail, and draft saves
+                labels = msg.get("labelIds", [])
+                if "UNREAD" not in labels or "SENT" in labels or "DRAFT" in labels:
+                    return
+                emails.append(self._email_from_metadata(msg))
+
+        batch = service.new_batch_http_request(callback=_collect)
+        for msg_id in message_ids[:count]:
+            batch.add(service.users().messages().get(
+                userId="me",
+                id=msg_id,
+                format="metadata",
+                metadataHeaders=["From", "Subject", "Date"],
+            ))
+        batch.execute()
+        logger.debug("New emails from history poll: %s", emails)
+        return emails
+
+    def _email_from_metadata(self, msg) -> Email:
+        headers = {h.get("name"): h.get("value", "") for h in msg.get("payload", {}).get("headers", [])}
+        return Email(
+            message_id=msg.get("id", ""),
+            thread_id=msg.get("threadId", ""),
+            sender=headers.get("From", ""),
+            subject=headers.get("Subject", ""),
+            date=headers.get("Date", ""),
+            body=msg.get("snippet", ""),
         )
-        response = self.agent.run(prompt)
-        print("\n[DEBUG] Raw LLM response for unread emails (JSON expected):\n", response.content)
+
+    def _check_via_llm(self, count: int) -> List[Email]:
+        prompt = _UNREAD_PROMPT % count
+        if ijson is not None and count >= _STREAM_MIN_COUNT:
+            try:
+                return self._check_via_llm_stream(prompt)
+            except Exception as e:
+                print(f"[GmailAgent] Streaming parse failed, falling back: {e}")
+        response = self.json_agent.run(prompt)
+        logger.debug("Raw LLM response for unread emails (JSON expected): %s", response.content)
         emails = []
         try:
             raw = response.content.strip()
-            # Remove code block markers if present
-            if raw.startswith("```"):
-                raw = re.sub(r"^```[a-zA-Z]*\n?", "", raw)
-                raw = re.sub(r"```$", "", raw)
-            emails = json.loads(raw)
+            if msgspec is not None:
+                # Parse straight into Email structs in C, skipping the
+                # intermediate dicts entirely
+                emails = msgspec.json.decode(
+                    raw.encode() if isinstance(raw, str) else raw,
+                    type=_EmailEnvelope,
+                ).emails
+            else:
+                if orjson is not None:
+                    parsed = orjson.loads(raw.encode() if isinstance(raw, str) else raw)
+                else:
+                    parsed = json.loads(raw)
+                if isinstance(parsed, dict):
+                    parsed = parsed.get("emails") or []
+                emails = [
+                    Email(
+                        message_id=str(e.get("message_id") or e.get("id") or ""),
+                        thread_id=str(e.get("thread_id", "")),
+                        sender=str(e.get("from", "")),
+                        subject=str(e.get("subject", "")),
+                        date=str(e.get("date", "")),
+                        body=str(e.get("body", "")),
+                    )
+                    for e in parsed if isinstance(e, dict)
+                ]
         except Exception as e:
             print(f"[GmailAgent] Error parsing JSON from LLM: {e}")
-        print("\n[DEBUG] Parsed emails list (from JSON):\n", emails)
-        print("[DEBUG] Calling notify_callback with emails:", emails)
-        if self.notify_callback:
-            self.notify_callback(emails)
+        logger.debug("Parsed emails list (from JSON): %s", emails)
+        return emails
+
+    def _check_via_llm_stream(self, prompt: str) -> List[Email]:
+        """
+        Streams the LLM response through ijson, building each Email as its
+        array element completes instead of buffering the whole payload.
+        """
+        chunks = self.json_agent.run(prompt, stream=True)
+        emails = []
+        try:
+            for item in ijson.items(_ChunkReader(chunks), "emails.item"):
+                if isinstance(item, dict):
+                    emails.append(Email(
+                        message_id=str(item.get("message_id") or item.get("id") or ""),
+                        thread_id=str(item.get("thread_id", "")),
+                        sender=str(item.get("from", "")),
+                        subject=str(item.get("subject", "")),
+                        date=str(item.get("date", "")),
+                        body=str(item.get("body", "")),
+                    ))
+        except Exception as e:
+            # A truncated stream still trips the parser at the end;
+            # keep whatever parsed cleanly unless nothing did
+            if not emails:
+                raise
+            logger.debug("Streaming parse ended early: %s", e)
+        logger.debug("Parsed emails list (streamed): %s", emails)
         return emails
 
     def _get_body_from_payload(self, payload):
-        import base64
         if payload.get("body", {}).get("data"):
             try:
-                return base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8", errors="ignore")
+                return urlsafe_b64decode(payload["body"]["data"]).decode("utf-8", errors="ignore")
             except Exception:
                 return ""
         # If multipart, try to find the text/plain part
         for part in payload.get("parts", []):
             if part.get("mimeType") == "text/plain" and part.get("body", {}).get("data"):
                 try:
-                    return base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8", errors="ignore")
+                    return urlsafe_b64decode(part["body"]["data"]).decode("utf-8", errors="ignore")
                 except Exception:
                     continue
         return ""
@@ -80,47 +336,6 @@ class GmailAgent:
         response = self.agent.run(prompt)
         return response.content
 
-    def _parse_emails(self, content: str) -> List[Dict]:
-        emails = []
-        current = {"message_id": "", "from": "", "subject": "", "date": "", "body": "", "thread_id": ""}
-        body_lines = []
-        for line in content.splitlines():
-            line = line.strip()
-            # Remove leading bullets, dashes, and markdown
-            line = re.sub(r"^[-*\d.\s]*", "", line)
-            line = re.sub(r"^\*\*|\*\*$", "", line)
-            if not line or line in ("---", "—", "----------------------------------------"):
-                if current["message_id"] or current["subject"] or current["from"]:
-                    current["body"] = "\n".join(body_lines).strip()
-                    emails.append(current.copy())
-                current = {"message_id": "", "from": "", "subject": "", "date": "", "body": "", "thread_id": ""}
-                body_lines = []
-                continue
-            if line.startswith("ID:") or line.startswith("Message ID:"):
-                # Extract only the alphanumeric message ID (no asterisks, no prefix)
-                match = re.search(r'([a-fA-F0-9]{10,})', line)
-                if match:
-                    current["message_id"] = match.group(1)
-                else:
-                    current["message_id"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Thread ID:"):
-                current["thread_id"] = line.split(":", 1)[1].strip()
-            elif line.startswith("From:"):
-                current["from"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Subject:"):
-                current["subject"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Date:"):
-                current["date"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Body:"):
-                body_lines.append(line.split(":", 1)[1].strip())
-            else:
-                body_lines.append(line)
-        if current["message_id"] or current["subject"] or current["from"]:
-            current["body"] = "\n".join(body_lines).strip()
-            emails.append(current.copy())
-        print("[DEBUG] All parsed emails:", emails)
-        return emails
-
 def gmail_assistant(
     action: Annotated[
         EmailAction,
@@ -161,10 +376,10 @@ def gmail_assistant(
 ):
     """Gmail Assistant powered by Agno and OpenAI"""
     
-    # Initialize the agent with Gmail tools and GPT-3.5-turbo
+    # Initialize the agent with Gmail tools and gpt-4o-mini
     agent = Agent(
-        model=OpenAIChat(id="gpt-3.5-turbo"),
-        tools=[GmailTools()],
+        model=OpenAIChat(id="gpt-4o-mini"),
+        tools=[_shared_gmail_tools()],
         show_tool_calls=True,
         markdown=True
     )
@@ -172,37 +387,15 @@ def gmail_assistant(
     try:
         if action == EmailAction.READ or action == EmailAction.ALL:
             print("\n📥 Reading latest unread emails...")
-            agent.print_response("""Show me my latest {count} unread emails. For each email, display:
-1. Message ID (prefix with 'ID: ')
-2. From
-3. Subject
-4. Date
-5. Body
-
-Format each email clearly with separators and make the Message ID prominent.""".format(count=count))
+            agent.print_response(_READ_PROMPT % count)
 
         if action == EmailAction.SEARCH and query:
             print(f"\n🔍 Searching emails for: {query}")
-            agent.print_response("""Search my emails for '{query}' and show me the top {count} results. For each email, display:
-1. Message ID (prefix with 'ID: ')
-2. From
-3. Subject
-4. Date
-5. Body
-
-Format each email clearly with separators and make the Message ID prominent.""".format(query=query, count=count))
+            agent.print_response(_SEARCH_PROMPT % (query, count))
 
         if action == EmailAction.REPLY or action == EmailAction.ALL:
             print("\n↩️ Checking emails that need replies...")
-            agent.print_response("""Find {count} important emails that need replies. For each email, display:
-1. Message ID (prefix with 'ID: ')
-2. From
-3. Subject
-4. Date
-5. Body
-6. Suggested Reply
-
-Format each email clearly with separators and make the Message ID prominent.""".format(count=count))
+            agent.print_response(_NEEDS_REPLY_PROMPT % count)
 
         if action == EmailAction.MANAGE or action == EmailAction.ALL:
             print("\n📊 Managing inbox...")
@@ -211,15 +404,7 @@ Format each email clearly with separators and make the Message ID prominent.""".
         if action == EmailAction.REPLY_TO and message_id:
             if not reply_text:
                 print("\n✍️ Getting email details and suggesting a reply...")
-                agent.print_response("""Get the email with message ID {message_id}. Show:
-1. Message ID (prefix with 'ID: ')
-2. From
-3. Subject
-4. Date
-5. Body
-6. Suggested Reply
-
-Format the email clearly and make the Message ID prominent.""".format(message_id=message_id))
+                agent.print_response(_SUGGEST_REPLY_PROMPT % message_id)
             else:
                 print("\n✉️ Sending reply...")
                 agent.print_response(f"Reply to the email with message ID {message_id} with the following text: {reply_text}")
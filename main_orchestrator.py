@@ -1,9 +1,20 @@
 import asyncio
+import logging
+from collections import OrderedDict
 from gmail_agent import GmailAgent
 from telegram_agent import TelegramAgent
 
-# Shared state to avoid duplicate notifications
-last_notified_ids = set()
+logger = logging.getLogger(__name__)
+
+# Shared state to avoid duplicate notifications.
+# Bounded LRU (insertion-ordered dict capped at _MAX_NOTIFIED_IDS) so a
+# long-running process doesn't accumulate message IDs forever.
+last_notified_ids = OrderedDict()
+_MAX_NOTIFIED_IDS = 4096
+
+# Event loop running the Telegram bot; captured in main() so sync callbacks
+# can schedule coroutines on it from any thread
+main_loop = None
 
 def handle_user_reply(message_id: str, reply_text: str):
     # Called by TelegramAgent when user replies
@@ -16,14 +27,20 @@ async def notify_telegram_async(email_details):
     await telegram_agent.notify_user(email_details)
 
 def handle_new_emails(email_details):
-    print("[DEBUG] handle_new_emails called with:", email_details)
+    logger.debug("handle_new_emails called with: %s", email_details)
     # Called by GmailAgent when new emails are found
     # Only notify about truly new emails
-    new_emails = [e for e in email_details if e.get('message_id') not in last_notified_ids]
+    new_emails = [e for e in email_details if e.message_id not in last_notified_ids]
     for e in new_emails:
-        last_notified_ids.add(e.get('message_id'))
+        last_notified_ids[e.message_id] = None
+        if len(last_notified_ids) > _MAX_NOTIFIED_IDS:
+            last_notified_ids.popitem(last=False)
     if new_emails:
-        asyncio.create_task(notify_telegram_async(new_emails))
+        if main_loop is not None:
+            # Thread-safe: works whether or not this callback runs on main_loop
+            asyncio.run_coroutine_threadsafe(notify_telegram_async(new_emails), main_loop)
+        else:
+            print("[Orchestrator] No event loop captured yet; dropping notification.")
 
 # Instantiate agents with callbacks
 gmail_agent = GmailAgent(notify_callback=handle_new_emails)
@@ -36,8 +53,10 @@ async def gmail_polling_loop():
         await asyncio.sleep(60)  # 1 minute interval
 
 def main():
+    global main_loop
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    main_loop = loop
     # Start Gmail polling as a background task
     loop.create_task(gmail_polling_loop())
     # Run the Telegram bot (blocking, in main thread)
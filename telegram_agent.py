@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from agno.agent import Agent
@@ -5,7 +6,10 @@ from agno.models.openai import OpenAIChat
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import logging
-from typing import Callable, Optional, Dict, List
+from typing import Callable, Optional, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from gmail_agent import Email
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,29 +23,37 @@ logger = logging.getLogger(__name__)
 
 class TelegramAgent:
     CHAT_ID_FILE = 'chat_id.txt'
+    MAX_MESSAGE_LEN = 4096  # Telegram Bot API limit per message
 
     def __init__(self, on_user_reply: Optional[Callable[[str, str], None]] = None, gmail_agent=None):
         self.agent = Agent(
-            model=OpenAIChat(id="gpt-3.5-turbo"),
+            model=OpenAIChat(id="gpt-4o-mini"),
             markdown=True
         )
         self.on_user_reply = on_user_reply
         self.application = None
         self.chat_id = self._load_chat_id()  # Load chat_id from file if present
+        self._saved_chat_id = self.chat_id  # Last value persisted to disk
         self.gmail_agent = gmail_agent  # Reference to GmailAgent for immediate check
 
     def _save_chat_id(self, chat_id):
+        # Handlers call this on every message; only touch disk when the value
+        # actually changes so the event loop isn't blocked on file I/O.
+        if chat_id == self._saved_chat_id:
+            return
         try:
             with open(self.CHAT_ID_FILE, 'w') as f:
                 f.write(str(chat_id))
+            self._saved_chat_id = chat_id
         except Exception as e:
             print(f"[ERROR] Failed to save chat_id: {e}")
 
     def _load_chat_id(self):
         try:
-            if os.path.exists(self.CHAT_ID_FILE):
-                with open(self.CHAT_ID_FILE, 'r') as f:
-                    return int(f.read().strip())
+            with open(self.CHAT_ID_FILE, 'r') as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"[ERROR] Failed to load chat_id: {e}")
         return None
@@ -108,23 +120,44 @@ Just send any message and I'll respond!
                 "I apologize, but I encountered an error processing your message. Please try again."
             )
 
-    async def notify_user(self, email_details: List[Dict]):
-        print("[DEBUG] TelegramAgent.notify_user called with:", email_details)
+    async def notify_user(self, email_details: List["Email"]):
+        logger.debug("notify_user called with: %s", email_details)
         try:
             if not self.chat_id:
                 logger.warning("No chat_id set. Cannot notify user.")
                 return
             if not email_details:
-                await self._send_message("No new emails found.")
+                await self.application.bot.send_message(chat_id=self.chat_id, text="No new emails found.")
                 return
+            chunks = []
             for email in email_details:
-                # Use the message_id directly from the parsed JSON
-                msg_id = email.get('message_id') or email.get('id')
-                print(f"[DEBUG] Sending to Telegram: {msg_id}")
-                msg = f"\nNew Email Received:\n"
-                msg += f"ID: {msg_id}\nFrom: {email.get('from', '')}\nSubject: {email.get('subject', '')}\nDate: {email.get('date', '')}\nBody: {email.get('body', '')}\n"
+                msg_id = email.message_id
+                logger.debug("Sending to Telegram: %s", msg_id)
+                msg = f"New Email Received:\n"
+                msg += f"ID: {msg_id}\nFrom: {email.sender}\nSubject: {email.subject}\nDate: {email.date}\nBody: {email.body}\n"
                 msg += f"\nTo reply, send: REPLY {msg_id} <your reply>"
-                await self.application.bot.send_message(chat_id=self.chat_id, text=msg)
+                chunks.append(msg)
+            # Coalesce all emails into one message; fall back to multiple
+            # parallel sends only when the 4096-char limit forces a split
+            text = "\n---\n".join(chunks)
+            if len(text) <= self.MAX_MESSAGE_LEN:
+                await self.application.bot.send_message(chat_id=self.chat_id, text=text)
+                return
+            parts = []
+            part = ""
+            for chunk in chunks:
+                candidate = chunk if not part else part + "\n---\n" + chunk
+                if len(candidate) > self.MAX_MESSAGE_LEN and part:
+                    parts.append(part)
+                    part = chunk
+                else:
+                    part = candidate
+            if part:
+                parts.append(part)
+            await asyncio.gather(*[
+                self.application.bot.send_message(chat_id=self.chat_id, text=p)
+                for p in parts
+            ])
         except Exception as e:
             print("[ERROR] Exception in notify_user:", e)
 